@@ -11,66 +11,185 @@ making the release.
 
 Usage:
 python make_release.py -u <ghusername> -p <ghpassword>
+
+Credentials can also come from the environment: GH_USER for the username
+and GH_TOKEN for the password/personal access token. With only GH_TOKEN
+set, token authentication is used and -u can be omitted.
 """
 
 
-import inspect
+import argparse
+import io
+import mmap
 import os
 import sys
-import getopt
 import re
+import shutil
+import subprocess
+import tempfile
+import time
 import zipfile
-from github3 import GitHub, GitHubError  # pip install github3.py
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+try:
+    #ISA-L's vectorized DEFLATE/CRC32 is 2-4x faster than zlib when present
+    from isal import isal_zlib as _zlib
+    _DEFLATE_LEVEL = 2  # ISA-L levels run 0-3; 2 trades roughly like zlib 6
+except ImportError:
+    _zlib = zlib
+    _DEFLATE_LEVEL = 6
+
+LIBVERSION_PAT = re.compile(rb"LIBVERSION\s=\s'(\d+\.\d+)';")
+
+#Suffixes whose content is already compressed; DEFLATE on them burns CPU
+#for no size gain (mex binaries are handled by prefix below)
+INCOMPRESSIBLE = {'.png', '.jpg', '.jpeg', '.gz', '.zip'}
+
+def collect(dir2zip):
+    # Single scandir-based walk caching (relpath, DirEntry) for every visible
+    # file; DirEntry serves is_file/is_dir from the readdir batch, so no
+    # extra stat call per entry as with os.walk. The cached list lets both
+    # release archives be built from one traversal.
+    entries = []
+    stack = [(dir2zip, '')]
+    while stack:
+        d, relprefix = stack.pop()
+        with os.scandir(d) as it:
+            for entry in it:
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    #Carry the relative prefix along instead of calling
+                    #os.path.relpath once per file
+                    stack.append((entry.path, relprefix + entry.name + os.sep))
+                elif entry.is_file(follow_symlinks=False):
+                    entries.append((relprefix + entry.name, entry))
+    return entries
 
-def zipdir(dir2zip, zipout, expand_dir = None):
+def deflate(path):
+    # Pool worker: raw DEFLATE stream (wbits=-15, no zlib header) so the
+    # blob can be stitched into the archive without recompressing
+    with open(path, 'rb') as f:
+        data = f.read()
+    co = _zlib.compressobj(_DEFLATE_LEVEL, _zlib.DEFLATED, -15)
+    return co.compress(data) + co.flush(), len(data), _zlib.crc32(data)
+
+def write_precompressed(zipout, zi, blob, file_size, crc):
+    # Append an entry whose payload was already compressed out of process.
+    # zipfile has no public API for this, so fill in sizes/CRC and emit the
+    # local header and payload directly, then register the entry so close()
+    # writes it into the central directory.
+    zi.file_size = file_size
+    zi.compress_size = len(blob)
+    zi.CRC = crc
+    zi.header_offset = zipout.fp.tell()
+    zipout.fp.write(zi.FileHeader())
+    zipout.fp.write(blob)
+    zipout.start_dir = zipout.fp.tell()
+    zipout.filelist.append(zi)
+    zipout.NameToInfo[zi.filename] = zi
+    zipout._didModify = True
+
+def zipentries(entries, zipout, expand_dir = None):
     # zipout is zipfile handle
-    for root, dirs, files in os.walk(dir2zip):
-        for fname in files:
-            if not fname.startswith('.'):
-                if expand_dir:
-                    split_path = list(os.path.split(root))
-                    split_path[0] = expand_dir
-                    new_root = os.path.join(*tuple(split_path))
-                    zipout.write(os.path.join(root, fname), arcname=os.path.join(new_root, fname))
-                else:
-                    zipout.write(os.path.join(root, fname))
+    # Build each ZipInfo from the DirEntry's cached stat rather than letting
+    # ZipFile.write re-stat the path
+    jobs = []
+    prefix = expand_dir.rstrip('/\\') + os.sep if expand_dir else None
+    for rel, entry in entries:
+        arcname = prefix + rel if prefix else entry.path
+        st = entry.stat()
+        zi = zipfile.ZipInfo(arcname.replace(os.sep, '/'),
+                             date_time=time.localtime(st.st_mtime)[:6])
+        zi.external_attr = (st.st_mode & 0xFFFF) << 16
+        dot = entry.name.rfind('.')
+        ext = entry.name[dot:].lower() if dot > 0 else ''
+        if ext in INCOMPRESSIBLE or ext.startswith('.mex'):
+            #Store already-compressed payloads verbatim; the stored path
+            #below skips zlib entirely
+            zi.compress_type = zipfile.ZIP_STORED
+        else:
+            zi.compress_type = zipout.compression
+        zi.file_size = st.st_size
+        jobs.append((zi, entry))
+    for zi, entry in jobs:
+        if zi.compress_type == zipfile.ZIP_DEFLATED:
+            continue
+        if zi.file_size <= (16 << 20):
+            #Small files: one read syscall and one writestr call, no
+            #per-chunk Python loop at all
+            with open(entry.path, 'rb') as src:
+                zipout.writestr(zi, src.read())
+        else:
+            #Stream the file in with a 1 MiB buffer instead of zipfile's
+            #default 8 KiB
+            with open(entry.path, 'rb') as src:
+                with zipout.open(zi, 'w') as dst:
+                    shutil.copyfileobj(src, dst, 1 << 20)
+    deflate_jobs = [j for j in jobs if j[0].compress_type == zipfile.ZIP_DEFLATED]
+    if deflate_jobs:
+        #ZipFile itself is single-threaded, but the per-file DEFLATE work is
+        #independent: compress in worker processes and stitch the blobs in
+        with ProcessPoolExecutor() as pool:
+            blobs = pool.map(deflate, [entry.path for zi, entry in deflate_jobs])
+            for (zi, entry), (blob, size, crc) in zip(deflate_jobs, blobs):
+                write_precompressed(zipout, zi, blob, size, crc)
+
+def zipdir_system(dir2zip, outpath, expand_dir):
+    # Fast path: hand the big archive to the native zip binary, which beats
+    # the pure-Python zipfile framing. The expand_dir arcname prefix is
+    # produced by zipping through a symlink in a staging directory, so this
+    # is POSIX-only; returns False when unavailable so the caller can fall
+    # back to zipdir.
+    if os.name != 'posix' or shutil.which('zip') is None:
+        return False
+    outpath = os.path.abspath(outpath)
+    with tempfile.TemporaryDirectory() as staging:
+        os.symlink(os.path.abspath(dir2zip), os.path.join(staging, expand_dir))
+        res = subprocess.run(['zip', '-q', '-6', '-r', outpath, expand_dir,
+                              '-x', '*/.*'],
+                             cwd=staging)
+    return res.returncode == 0
 
 def main(argv):
-    # Parse input arguments into username and password
-    username = ''
-    password = ''
-    try:
-        opts, args = getopt.getopt(argv,"u:p:",["username=","password="])
-    except getopt.GetoptError:
-        print('make_release.py -u <ghusername> -p <ghpassword>')
-        sys.exit(2)
-    if len(opts) < 2:
-        print('make_release.py -u <ghusername> -p <ghpassword>')
-        sys.exit(2)
-    for opt, arg in opts:
-        if opt == '-h':
-            print('make_release.py -u <ghusername> -p <ghpassword>')
-            sys.exit()
-        elif opt in ("-u", "--username"):
-            username = arg
-        elif opt in ("-p", "--password"):
-            password = arg
-    
+    # Parse input arguments into username and password/token, falling back
+    # to the environment so CI can avoid putting credentials on the CLI
+    parser = argparse.ArgumentParser(
+        description='Create a GitHub release of this repository.')
+    parser.add_argument('-u', '--username', default=os.environ.get('GH_USER'))
+    parser.add_argument('-p', '--password', default=os.environ.get('GH_TOKEN'),
+                        help='password or personal access token '
+                             '(defaults to GH_TOKEN)')
+    args = parser.parse_args(argv)
+    if not args.password:
+        parser.error('a password or token is required (-p or GH_TOKEN)')
+
+    # Deferred: github3 drags in requests/urllib3/cryptography, a couple
+    # hundred ms of cold start that -h and argument errors never need
+    from github3 import GitHub, GitHubError  # pip install github3.py
+
+
     # Scan the xdf/load_xdf.m file and pull out the version
-    filename = inspect.getframeinfo(inspect.currentframe()).filename
-    root_path = os.path.dirname(os.path.abspath(filename))
+    root_path = os.path.dirname(os.path.abspath(__file__))
     mfile_path = os.path.join(root_path, 'Matlab', 'xdf', 'load_xdf.m')
+    #One C-level regex search over the mmap'd file instead of a per-line
+    #Python loop that keeps running after the version has been found
     version_found = False
-    with open(mfile_path) as f:
-        for line in f:
-            if not version_found:
-                m = re.match("LIBVERSION\s=\s'(\d+\.\d+)';", line)
-                if m:
-                    mfile_version = m.group(1)
-                    version_found = True
+    with open(mfile_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            m = LIBVERSION_PAT.search(mm)
+            if m:
+                mfile_version = m.group(1).decode()
+                version_found = True
     
-    # Create a GitHub instance and access the repository
-    g = GitHub(username, password)
+    # Create a GitHub instance and access the repository; with no username
+    # the password is treated as a personal access token, skipping the
+    # Basic-Auth roundtrip
+    if args.username:
+        g = GitHub(args.username, args.password)
+    else:
+        g = GitHub(token=args.password)
     repo = g.repository('sccn', 'xdf')
     
     if version_found:
@@ -79,35 +198,83 @@ def main(argv):
         try:
             release = repo.create_release('v'+mfile_version, target_commitish='master')
         except GitHubError:
-            print('Release for version ' + mfile_version + ' already exists or validation failed.')
-            return None
+            #Retry path: pick up the existing release so an interrupted run
+            #can resume its uploads instead of bailing out
+            try:
+                release = repo.release_from_tag('v' + mfile_version)
+            except GitHubError:
+                release = None
+            if release is None:
+                print('Release for version ' + mfile_version + ' already exists or validation failed.')
+                return None
         
+        #Walk the Matlab tree once and build both archives from the cached
+        #file list instead of stat'ing the xdf/ subtree twice
+        entries = collect('Matlab/')
+
         #zip contents of Matlab\* into xdfimport<version#>.zip
         eeglabfn = 'xdfimport' + mfile_version + '.zip'
-        zf = zipfile.ZipFile(eeglabfn, mode='w', compression=zipfile.ZIP_DEFLATED)
-        zipdir('Matlab/', zf, 'xdfimport' + mfile_version)
-        zf.close()
-        
-        #zip contents of Matlab\xdf\* into xdf.zip
-        zf2 = zipfile.ZipFile('xdf.zip', mode='w', compression=zipfile.ZIP_DEFLATED)
-        zipdir('Matlab/xdf/', zf2, 'xdf')
-        zf2.close()
-        
+        if not zipdir_system('Matlab/', eeglabfn, 'xdfimport' + mfile_version):
+            #compresslevel=6 is zlib's speed/size sweet spot; higher levels
+            #cost noticeably more CPU for a negligibly smaller archive
+            zf = zipfile.ZipFile(eeglabfn, mode='w', compression=zipfile.ZIP_DEFLATED,
+                                 compresslevel=6)
+            zipentries(entries, zf, 'xdfimport' + mfile_version)
+            zf.close()
+
+        #zip contents of Matlab\xdf\* into xdf.zip, built in memory so the
+        #archive is never written to disk only to be read straight back
+        prefix = 'xdf' + os.sep
+        xdf_entries = [(rel[len(prefix):], e) for rel, e in entries
+                       if rel.startswith(prefix)]
+        xdfbuf = io.BytesIO()
+        with zipfile.ZipFile(xdfbuf, mode='w', compression=zipfile.ZIP_DEFLATED,
+                             compresslevel=6) as zf2:
+            zipentries(xdf_entries, zf2, 'xdf')
+        xdfbuf.seek(0)
+
         #http://github3py.readthedocs.org/en/latest/repos.html#github3.repos.release.Release.upload_asset
-        #Upload zip files as release assets
-        with open(eeglabfn, 'rb') as fd:
-            content = fd.read()
-            release.upload_asset('application/zip', eeglabfn, content)
-        with open('xdf.zip', 'rb') as fd:
-            content = fd.read()
-            release.upload_asset('application/zip', 'xdf.zip', content)
-        #Upload mex files as release assets
-        for fn in os.listdir('Matlab/xdf/'):
-            fname, fext = os.path.splitext(fn)
-            if len(fext) > 3 and fext[:4] == '.mex':
-                with open(os.path.join('Matlab', 'xdf', fn), 'rb') as fd:
-                    content = fd.read()
-                release.upload_asset('application/octet-stream', fn, content)
+        #Collect all assets (zip archives plus mex files), then upload them
+        #concurrently; each upload is an independent blocking HTTPS request
+        assets = [('application/zip', eeglabfn, eeglabfn),
+                  ('application/zip', 'xdf.zip', xdfbuf)]
+        with os.scandir('Matlab/xdf/') as it:
+            for e in it:
+                if not e.is_file(follow_symlinks=False) or e.name.startswith('.'):
+                    continue
+                dot = e.name.rfind('.')
+                if dot > 0 and e.name[dot:dot + 4] == '.mex':
+                    assets.append(('application/octet-stream', e.name, e.path))
+        #Skip assets already on the release with a matching size, so a
+        #retried run only re-uploads what is missing or changed (the API
+        #exposes no content hash, so name+size is the available check)
+        existing = {a.name: a.size for a in release.assets()}
+        assets = [a for a in assets if existing.get(a[1]) != asset_size(a[2])]
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            for f in [pool.submit(upload_asset, release, a) for a in assets]:
+                f.result()
+
+def asset_size(source):
+    # source is a path or an in-memory buffer
+    if hasattr(source, 'getbuffer'):
+        return source.getbuffer().nbytes
+    return os.path.getsize(source)
+
+def upload_asset(release, asset):
+    # asset is a (content_type, name, source) tuple; source is a path or an
+    # already-open file-like object such as an in-memory archive
+    content_type, name, source = asset
+    #Post through the release's existing authenticated session so all assets
+    #reuse one TCP+TLS connection instead of handshaking per upload; requests
+    #derives Content-Length from the file size and streams the body
+    url = release.upload_urlt.expand({'name': name})
+    headers = {'Content-Type': content_type}
+    if hasattr(source, 'read'):
+        resp = release.session.post(url, data=source, headers=headers)
+    else:
+        with open(source, 'rb') as fd:
+            resp = release.session.post(url, data=fd, headers=headers)
+    resp.raise_for_status()
 
 if __name__ == "__main__":
     main(sys.argv[1:])
\ No newline at end of file